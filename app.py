@@ -1,13 +1,59 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import base64
+import re
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from io import BytesIO
-from datetime import timedelta, datetime, time
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+# plotly and reportlab are imported where they are used, so the first page load
+# (before any upload) doesn't pay for them
+
+# Fields based on assumed image data, scored for consultation completeness
+FIELDS_TO_CHECK = (
+    'PatientName',
+    'Age',
+    'GenderDisplay',
+    'ConsultationCreatedDate',
+    'ConsultationStatus',
+    'Symptoms_',
+    'Provisional Diagnosis',
+    'Advice'
+)
+
+# Columns the report reads from the upload; everything else is skipped at parse time
+INPUT_COLUMNS = frozenset([
+    'PatientId', 'ConsultationId', 'PatientName', 'Age', 'GenderDisplay',
+    'ConsultationCreatedDate', 'ConsultationStatus', 'Symptoms_',
+    'Provisional Diagnosis', 'Advice', 'HH_MM_SS'
+])
+
+# [HH:]MM:SS, as typed or as stringified Excel time cells
+HH_MM_SS_PATTERN = re.compile(r'^(?:(\d+):)?(\d+):(\d+)$')
+# Only the first few unparseable HH_MM_SS rows get a warning message; the rest are counted
+TIME_WARNING_PREVIEW = 5
+# '00'..'59', looked up by minute or second when formatting durations
+TWO_DIGITS = np.array([f'{i:02d}' for i in range(60)], dtype=object)
+
+# The on-page report table shows at most this many rows unless the user asks for all of them
+DATAFRAME_PREVIEW_ROWS = 1000
+
+# reportlab lays tables out in Python, so the PDF lists at most this many (lowest-scoring) rows
+PDF_DETAIL_ROW_LIMIT = 200
+# Above this many rows the PDF swaps the detail table for a score distribution chart
+PDF_CHART_ROW_THRESHOLD = 500
+# Symptoms, Diagnosis and Advice cells in the PDF are cut to this many characters
+PDF_TEXT_CELL_LIMIT = 1000
+
+# st.cache_data entry limits. A parsed upload can be hundreds of MB, so only the last couple
+# are kept; the report, summary and export caches gain an entry per filter state (every
+# search keystroke), so they keep a short history and evict the rest
+UPLOAD_CACHE_ENTRIES = 2
+REPORT_CACHE_ENTRIES = 8
+EXPORT_CACHE_ENTRIES = 4
 
 # Streamlit app
 def main():
@@ -115,11 +161,8 @@ def main():
 
     if uploaded_file is not None:
         try:
-            # Load Excel file
-            df = pd.read_excel(uploaded_file)
-            
-            # Ensure ConsultationCreatedDate is in datetime format
-            df['ConsultationCreatedDate'] = pd.to_datetime(df['ConsultationCreatedDate'], errors='coerce')
+            # Load Excel file (parsed once per uploaded file, then served from cache)
+            df = load_excel(uploaded_file.getvalue())
             
             # Update session state with data-driven date defaults if available
             if not df['ConsultationCreatedDate'].isna().all():
@@ -128,31 +171,33 @@ def main():
                 st.session_state.start_date = min_date
                 st.session_state.end_date = max_date
             
-            # Filter data by date range
-            filtered_df = filter_by_date_range(df, st.session_state.start_date, st.session_state.end_date)
+            if st.session_state.start_date > st.session_state.end_date:
+                st.warning("Start Date is after End Date, so no consultations can match the date range.")
             
-            # Further filter by patient ID or name
-            filtered_df = filter_by_patient_search(filtered_df, patient_id, patient_name)
+            # Filter data by date range and patient ID or name in one slice
+            mask = build_filter_mask(df, st.session_state.start_date, st.session_state.end_date, patient_id, patient_name)
+            filtered_df = df[mask]
+            # Prepare Excel/PDF clicks apply to the report they were made for; a new upload or
+            # any filter change clears them so the exports aren't rebuilt on every rerun
+            report_key = (uploaded_file.file_id, st.session_state.start_date, st.session_state.end_date, patient_id, patient_name)
+            if st.session_state.get('export_report_key') != report_key:
+                st.session_state.export_report_key = report_key
+                st.session_state.excel_requested = False
+                st.session_state.pdf_requested = False
             
             # Generate report
             report_df = generate_consultation_report(filtered_df)
             
             if report_df is not None and not report_df.empty:
-                # Calculate summary statistics
-                total_patients = len(report_df)
-                avg_score = report_df['CompletionScore (%)'].mean()
-                max_score = report_df['CompletionScore (%)'].max()
-                min_score = report_df['CompletionScore (%)'].min()
-                avg_missing_score = report_df['MissingFieldScore'].mean()
-                avg_time, valid_count, error_messages = calculate_average_consultation_time(filtered_df)
-                
-                # Calculate percentages for pie chart
-                high_score_count = len(report_df[report_df['CompletionScore (%)'] >= 75])
-                low_score_count = len(report_df[report_df['CompletionScore (%)'] < 50])
-                other_score_count = total_patients - high_score_count - low_score_count
-                high_score_percent = (high_score_count / total_patients * 100) if total_patients > 0 else 0
-                low_score_percent = (low_score_count / total_patients * 100) if total_patients > 0 else 0
-                other_score_percent = (other_score_count / total_patients * 100) if total_patients > 0 else 0
+                # Calculate summary statistics (cached, so reruns on an unchanged report are free)
+                stats = summarize_report(report_df)
+                total_patients = stats['total_patients']
+                avg_score, max_score, min_score = stats['avg_score'], stats['max_score'], stats['min_score']
+                avg_missing_score = stats['avg_missing_score']
+                high_score_percent = stats['high_score_percent']
+                low_score_percent = stats['low_score_percent']
+                other_score_percent = stats['other_score_percent']
+                avg_time, valid_count, error_messages, error_count = calculate_average_consultation_time(filtered_df)
 
                 # Dashboard section
                 with st.container():
@@ -163,6 +208,7 @@ def main():
                             'Category': ['Score >= 75%', 'Score < 50%', 'Score 50-75%'],
                             'Percentage': [high_score_percent, low_score_percent, other_score_percent]
                         })
+                        import plotly.express as px
                         fig = px.pie(pie_data, values='Percentage', names='Category', title='Score Distribution')
                         fig.update_layout(margin=dict(t=30, b=10, l=10, r=10))
                         st.plotly_chart(fig, use_container_width=True)
@@ -182,13 +228,28 @@ def main():
 
                 # Patient Consultation Report
                 with st.expander("Patient Consultation Report", expanded=True):
-                    st.dataframe(report_df, use_container_width=True, height=300)
+                    # The whole frame is shipped to the browser, so large reports show a preview by default
+                    preview_df = report_df
+                    if len(report_df) > DATAFRAME_PREVIEW_ROWS:
+                        if not st.checkbox(f"Show all {len(report_df)} rows", key="show_all_rows"):
+                            preview_df = report_df.head(DATAFRAME_PREVIEW_ROWS)
+                            st.caption(f"Showing first {DATAFRAME_PREVIEW_ROWS} of {len(report_df)} rows; downloads include every row.")
+                    st.dataframe(preview_df, use_container_width=True, height=300)
 
                 # Download buttons
                 with st.container():
                     st.subheader("Download Reports")
-                    col5, col6, col7 = st.columns(3)
+                    # Parquet and CSV are cheap to write; Excel and PDF are only built once requested
+                    col5, col6, col7, col8 = st.columns(4)
                     with col5:
+                        parquet_data = convert_df_to_parquet(report_df)
+                        st.download_button(
+                            label="Parquet",
+                            data=parquet_data,
+                            file_name="consultation_report.parquet",
+                            mime="application/vnd.apache.parquet",
+                        )
+                    with col6:
                         csv = convert_df_to_csv(report_df)
                         st.download_button(
                             label="CSV",
@@ -196,28 +257,41 @@ def main():
                             file_name="consultation_report.csv",
                             mime="text/csv",
                         )
-                    with col6:
-                        excel_data = generate_excel_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score)
-                        st.download_button(
-                            label="Excel",
-                            data=excel_data,
-                            file_name="consultation_report.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        )
                     with col7:
-                        pdf_data = generate_pdf_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score)
-                        st.download_button(
-                            label="PDF",
-                            data=pdf_data,
-                            file_name="consultation_report.pdf",
-                            mime="application/pdf",
-                        )
+                        if st.button("Prepare Excel", key="prepare_excel"):
+                            st.session_state.excel_requested = True
+                        if st.session_state.get('excel_requested'):
+                            excel_data = generate_excel_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score, stats['high_mask'], stats['mid_mask'])
+                            st.download_button(
+                                label="Excel",
+                                data=excel_data,
+                                file_name="consultation_report.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            )
+                    with col8:
+                        if st.button("Prepare PDF", key="prepare_pdf"):
+                            st.session_state.pdf_requested = True
+                        if st.session_state.get('pdf_requested'):
+                            try:
+                                pdf_data = generate_pdf_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score)
+                            except Exception as e:
+                                # Failed builds aren't cached, so drop the request rather than retry on every rerun
+                                st.session_state.pdf_requested = False
+                                st.error(f"Error generating PDF: {str(e)}")
+                            else:
+                                st.download_button(
+                                    label="PDF",
+                                    data=pdf_data,
+                                    file_name="consultation_report.pdf",
+                                    mime="application/pdf",
+                                )
 
                 # Notes section
                 with st.expander("Notes", expanded=False):
                     st.markdown(f"**Time Processing Info:** Processed {valid_count} valid time entries.")
                     if error_messages:
-                        st.markdown("**Warnings:**\n- " + "\n- ".join(error_messages[:5]) + ("\n- ...and more" if len(error_messages) > 5 else ""))
+                        hidden_count = error_count - min(error_count, TIME_WARNING_PREVIEW)
+                        st.markdown("**Warnings:**\n- " + "\n- ".join(error_messages) + (f"\n- ...and {hidden_count} more" if hidden_count else ""))
             else:
                 st.error("No data to display. The file may be empty, incorrectly formatted, or no records match the filters.")
         
@@ -226,98 +300,91 @@ def main():
     else:
         st.info("Please upload an Excel file to proceed.")
 
-# Function to parse HH_MM_SS column to seconds for average calculation
-def parse_hh_mm_ss(time_input):
-    try:
-        if isinstance(time_input, time):
-            time_str = time_input.strftime('%H:%M:%S')
+# Load the uploaded Excel file; cached on the file bytes so reruns skip the parse
+@st.cache_data(show_spinner="Reading Excel file...", max_entries=UPLOAD_CACHE_ENTRIES)
+def load_excel(file_bytes):
+    # calamine (Rust) parses xlsx far faster than openpyxl; the callable usecols tolerates absent columns.
+    # IDs are identifiers, not numbers, so they are read straight into Arrow strings.
+    df = pd.read_excel(
+        BytesIO(file_bytes),
+        engine='calamine',
+        usecols=lambda column: column in INPUT_COLUMNS,
+        dtype={'PatientId': 'string[pyarrow]', 'ConsultationId': 'string[pyarrow]'}
+    )
+    # calamine returns duration cells as pd.Timedelta, which stringifies as '0 days 00:03:04';
+    # spell them out as H:MM:SS so they parse and display like typed times
+    if 'HH_MM_SS' in df:
+        df['HH_MM_SS'] = format_durations(df['HH_MM_SS'])
+    # Ensure ConsultationCreatedDate is in datetime format
+    df['ConsultationCreatedDate'] = pd.to_datetime(df['ConsultationCreatedDate'], errors='coerce')
+    # Arrow-backed strings keep nulls in a validity bitmap and compare/strip in C++ kernels
+    text_columns = df.select_dtypes(include='object').columns
+    df[text_columns] = df[text_columns].astype('string[pyarrow]')
+    # Blank or whitespace-only text in the checked fields becomes NA once, here, instead of
+    # being compared against '' for every cell at scoring time
+    for field in FIELDS_TO_CHECK:
+        if field in df and isinstance(df[field].dtype, pd.StringDtype):
+            df[field] = df[field].mask(df[field].str.strip() == '')
+    # Lower-cased search keys, built once so patient search is a plain substring scan
+    # (an absent column gets an all-NA key, which simply never matches)
+    for column, search_key in (('PatientId', '_pid_lc'), ('PatientName', '_pname_lc')):
+        if column in df:
+            df[search_key] = df[column].astype('string[pyarrow]').str.lower()
         else:
-            time_str = str(time_input)
-            if pd.isna(time_str) or time_str == '':
-                return None, "Empty or NaN"
-        
-        parts = time_str.split(':')
-        if len(parts) == 2:
-            minutes, seconds = map(int, parts)
-            hours = 0
-        elif len(parts) == 3:
-            hours, minutes, seconds = map(int, parts)
-        else:
-            return None, f"Invalid format: {time_str}"
-        
-        if hours < 0 or minutes < 0 or seconds < 0 or minutes >= 60 or seconds >= 60:
-            return None, f"Invalid time values: {time_str}"
-        
-        return hours * 3600 + minutes * 60 + seconds, None
-    except Exception as e:
-        return None, f"Error parsing {time_str}: {str(e)}"
-
-# Function to get time taken from HH_MM_SS column
-def get_time_taken(row):
-    try:
-        time_input = row.get('HH_MM_SS', 'Unknown')
-        if pd.isna(time_input) or time_input == '':
-            return "Unknown"
-        if isinstance(time_input, time):
-            return time_input.strftime('%H:%M:%S')
-        return str(time_input)
-    except:
-        return "Unknown"
-
-# Function to calculate consultation completion score, filled fields, and missing fields
-def calculate_completion_score(row):
-    score = 0
-    total_fields = 8
-    filled_fields = []
-    missing_fields = []
-
-    # Fields based on assumed image data
-    fields_to_check = [
-        'PatientName',
-        'Age',
-        'GenderDisplay',
-        'ConsultationCreatedDate',
-        'ConsultationStatus',
-        'Symptoms_',
-        'Provisional Diagnosis',
-        'Advice'
-    ]
+            df[search_key] = pd.Series(pd.NA, index=df.index, dtype='string[pyarrow]')
+    return df
 
-    for field in fields_to_check:
-        value = row.get(field)
-        if pd.isna(value):
-            missing_fields.append(field)
-        elif field == 'Symptoms_' and isinstance(value, str) and '"Alias"' in value:
-            # Handle malformed Symptoms_ data (e.g., [{Alias":"Common Cold")
-            score += 1
-            filled_fields.append(field)
-        elif value != '':
-            score += 1
-            filled_fields.append(field)
-        else:
-            missing_fields.append(field)
+# Seconds as [-]H:MM:SS text (hours are not wrapped at a day); NaN/NaT stays missing
+def seconds_to_hh_mm_ss(total_seconds):
+    known = total_seconds.dropna()
+    whole = known.abs().astype('int64')
+    hours, minutes, seconds = whole // 3600, whole % 3600 // 60, whole % 60
+    sign = pd.Series(np.where(known < 0, '-', ''), index=known.index)
+    text = sign + hours.astype(str) + ':' + TWO_DIGITS[minutes] + ':' + TWO_DIGITS[seconds]
+    return text.reindex(total_seconds.index)
 
-    # Calculate completion percentage
-    completion_percentage = (score / total_fields) * 100 if total_fields > 0 else 0
-    # Calculate missing fields percentage
-    missing_percentage = ((total_fields - score) / total_fields) * 100 if total_fields > 0 else 0
-    return round(completion_percentage, 2), filled_fields, missing_fields, round(missing_percentage, 2), fields_to_check
+# Duration cells as H:MM:SS text; other values pass through
+def format_durations(times):
+    # A column of nothing but duration cells comes back as timedelta64 and is formatted as a whole
+    if times.dtype.kind == 'm':
+        return seconds_to_hh_mm_ss(times.dt.total_seconds())
+    if times.dtype != object:
+        return times
+    is_duration = times.map(lambda value: isinstance(value, timedelta)).astype(bool)
+    if not is_duration.any():
+        return times
+    text = seconds_to_hh_mm_ss(pd.to_timedelta(times[is_duration]).dt.total_seconds())
+    return times.astype(object).mask(is_duration, text)
 
 # Calculate average consultation time from HH_MM_SS
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES)
 def calculate_average_consultation_time(df):
-    total_seconds = 0
-    valid_count = 0
-    error_messages = []
-    for _, row in df.iterrows():
-        time_seconds, error = parse_hh_mm_ss(row.get('HH_MM_SS', ''))
-        if time_seconds is not None:
-            total_seconds += time_seconds
-            valid_count += 1
-        else:
-            if error:
-                error_messages.append(f"Row {row.name + 2}: {error}")
+    raw = df['HH_MM_SS'] if 'HH_MM_SS' in df else pd.Series(index=df.index, dtype=object)
+    # time cells stringify as HH:MM:SS; one compiled regex splits the whole column into parts
+    raw_strs = raw.astype(str)
+    # surrounding spaces (e.g. ' 00:05:10') are tolerated, as int() did in the old per-row parser
+    parts = raw_strs.str.strip().str.extract(HH_MM_SS_PATTERN).astype(float)
+    hours, minutes, seconds = parts[0].fillna(0), parts[1], parts[2]
+    valid = seconds.notna() & (minutes < 60) & (seconds < 60)
+    durations = hours * 3600 + minutes * 60 + seconds
+    valid_count = int(valid.sum())
+
+    # Warnings for the first rows that did not parse, built column-wise rather than row by row
+    # (a value that has the [HH:]MM:SS shape but minutes or seconds of 60+ is out of range,
+    # anything else unparseable is a format error); every other invalid row is only counted
+    invalid = ~valid
+    error_count = int(invalid.sum())
+    shown = invalid & (invalid.cumsum() <= TIME_WARNING_PREVIEW)
+    empty = (raw.isna() | (raw_strs == ''))[shown]
+    out_of_range = seconds.notna()[shown]
+    shown_strs = raw_strs[shown]
+    reasons = ("Invalid format: " + shown_strs).mask(out_of_range, "Invalid time values: " + shown_strs)
+    reasons = reasons.mask(empty, "Empty or NaN")
+    row_numbers = pd.Series(df.index[shown] + 2, index=reasons.index).astype(str)
+    error_messages = ("Row " + row_numbers + ": " + reasons).tolist()
+
     if valid_count > 0:
-        avg_seconds = total_seconds / valid_count
+        avg_seconds = durations[valid].mean()
         minutes = int(avg_seconds // 60)
         seconds = int(avg_seconds % 60)
         result = f"{minutes:02d}:{seconds:02d}"
@@ -325,75 +392,113 @@ def calculate_average_consultation_time(df):
         result = "00:00"
         error_messages.append("No valid time entries found in HH_MM_SS column.")
     
-    return result, valid_count, error_messages
-
-# Filter DataFrame by date range
-def filter_by_date_range(df, start_date, end_date):
-    try:
-        df['ConsultationCreatedDate'] = pd.to_datetime(df['ConsultationCreatedDate'], errors='coerce')
-        mask = (df['ConsultationCreatedDate'].dt.date >= start_date) & (df['ConsultationCreatedDate'].dt.date <= end_date)
-        return df[mask]
-    except Exception as e:
-        st.error(f"Error filtering by date: {e}")
-        return df
-
-# Filter DataFrame by PatientId or PatientName
-def filter_by_patient_search(df, patient_id, patient_name):
-    try:
-        filtered_df = df
-        if patient_id:
-            filtered_df = filtered_df[filtered_df['PatientId'].astype(str).str.contains(patient_id, case=False, na=False)]
-        if patient_name:
-            filtered_df = filtered_df[filtered_df['PatientName'].astype(str).str.contains(patient_name, case=False, na=False)]
-        return filtered_df
-    except Exception as e:
-        st.error(f"Error filtering by patient search: {e}")
-        return df
+    return result, valid_count, error_messages, error_count
+
+# Boolean row mask for the date range and PatientId / PatientName search, so the
+# DataFrame is sliced (and copied) only once
+def build_filter_mask(df, start_date, end_date, patient_id, patient_name):
+    # ConsultationCreatedDate is already datetime64 (coerced once in load_excel).
+    # Compare against Timestamp bounds instead of boxing a date per row;
+    # the upper bound is the start of the day after end_date so that whole day is included
+    dates = df['ConsultationCreatedDate']
+    mask = (dates >= pd.Timestamp(start_date)) & (dates < pd.Timestamp(end_date) + pd.Timedelta(days=1))
+    if patient_id:
+        mask &= df['_pid_lc'].str.contains(patient_id.lower(), regex=False, na=False)
+    if patient_name:
+        mask &= df['_pname_lc'].str.contains(patient_name.lower(), regex=False, na=False)
+    return mask.to_numpy(dtype=bool)
 
 # Process the data and generate report
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES)
 def generate_consultation_report(df):
     if df is None or df.empty:
         return None
 
-    report = []
-    for index, row in df.iterrows():
-        patient_id = row.get('PatientId', 'Unknown')
-        consultation_id = row.get('ConsultationId', 'Unknown')
-        completion_score, filled_fields, missing_fields, missing_percentage, _ = calculate_completion_score(row)
-        time_taken = get_time_taken(row)
-        
-        patient_report = {
-            'PatientId': patient_id,
-            'ConsultationId': consultation_id,
-            'CompletionScore (%)': completion_score,
-            'CompletionField': ', '.join(filled_fields),
-            'MissingFieldScore': missing_percentage,
-            'MissingFields': ', '.join(missing_fields),
-            'TimeTaken (MM:SS)': time_taken,
-            'Status': row.get('ConsultationStatus', 'Unknown'),
-            'Symptoms': row.get('Symptoms_', ''),
-            'Diagnosis': row.get('Provisional Diagnosis', ''),
-            'Advice': row.get('Advice', '')
-        }
-        report.append(patient_report)
+    total_fields = len(FIELDS_TO_CHECK)
 
-    report_df = pd.DataFrame(report)
-    column_order = [
-        'PatientId', 'ConsultationId', 'CompletionScore (%)', 'CompletionField',
-        'MissingFieldScore', 'MissingFields', 'TimeTaken (MM:SS)', 'Status',
-        'Symptoms', 'Diagnosis', 'Advice'
-    ]
-    report_df = report_df[column_order]
+    # Score every row at once: blanks were turned into NA by load_excel, so filled means notna
+    # (malformed Symptoms_ such as [{Alias":"Common Cold") is a non-empty string, so it counts)
+    # One contiguous (rows x fields) bool matrix; every reduction below runs on it in NumPy.
+    # Fields absent from the upload simply stay False.
+    available = frozenset(df.columns)
+    present = np.zeros((len(df), total_fields), dtype=bool)
+    for position, field in enumerate(FIELDS_TO_CHECK):
+        if field in available:
+            present[:, position] = df[field].notna().to_numpy()
+    score = present.sum(axis=1)
+    completion_scores = np.round(score * (100.0 / total_fields), 2)
+    missing_scores = np.round((total_fields - score) * (100.0 / total_fields), 2)
+    # Each row's filled/missing pattern as a bitmask; the ', '-joined labels are built once per
+    # distinct pattern (at most 2**fields, usually a few dozen) instead of once per row
+    patterns = present @ (1 << np.arange(total_fields))
+    unique_patterns, pattern_codes = np.unique(patterns, return_inverse=True)
+    filled_labels = [', '.join(f for bit, f in enumerate(FIELDS_TO_CHECK) if p >> bit & 1) for p in unique_patterns]
+    missing_labels = [', '.join(f for bit, f in enumerate(FIELDS_TO_CHECK) if not p >> bit & 1) for p in unique_patterns]
+    filled_fields = pd.Categorical.from_codes(pattern_codes, categories=filled_labels)
+    missing_fields = pd.Categorical.from_codes(pattern_codes, categories=missing_labels)
+
+    # Fetch each output column once; a column absent from the upload falls back to its default
+    # (as an Arrow string column, like the text columns load_excel produces)
+    def column(name, default):
+        if name in df:
+            return df[name].array
+        return pd.array(np.full(len(df), default, dtype=object), dtype='string[pyarrow]')
+
+    # Time taken is shown as given: Excel time cells stringify as HH:MM:SS, blanks become Unknown
+    raw_times = df['HH_MM_SS'] if 'HH_MM_SS' in df else pd.Series(np.nan, index=df.index, dtype=object)
+    time_taken = raw_times.astype(str).mask(raw_times.isna() | (raw_times == ''), 'Unknown')
+
+    # Columns are listed in display order, already in their final dtypes, and handed over
+    # without a defensive copy
+    report_df = pd.DataFrame({
+        'PatientId': column('PatientId', 'Unknown'),
+        'ConsultationId': column('ConsultationId', 'Unknown'),
+        'CompletionScore (%)': completion_scores.astype(np.float32),
+        'CompletionField': filled_fields,
+        'MissingFieldScore': missing_scores.astype(np.float32),
+        'MissingFields': missing_fields,
+        'TimeTaken (MM:SS)': time_taken.to_numpy(),
+        'Status': pd.Categorical(column('ConsultationStatus', 'Unknown')),
+        'Symptoms': column('Symptoms_', ''),
+        'Diagnosis': column('Provisional Diagnosis', ''),
+        'Advice': column('Advice', '')
+    }, copy=False)
     return report_df
 
+# Summary statistics and score-bucket percentages for the dashboard and exports
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES)
+def summarize_report(report_df):
+    total_patients = len(report_df)
+    score_stats = report_df['CompletionScore (%)'].agg(['mean', 'max', 'min'])
+    # One sweep buckets every score: 0 = below 50, 1 = 50-75, 2 = 75 and above
+    score_buckets = np.digitize(report_df['CompletionScore (%)'].to_numpy(), [50, 75])
+    low_score_count, other_score_count, high_score_count = np.bincount(score_buckets, minlength=3)
+    return {
+        'total_patients': total_patients,
+        'avg_score': float(score_stats['mean']),
+        'max_score': float(score_stats['max']),
+        'min_score': float(score_stats['min']),
+        'avg_missing_score': float(report_df['MissingFieldScore'].mean()),
+        'high_score_percent': (high_score_count / total_patients * 100) if total_patients > 0 else 0,
+        'low_score_percent': (low_score_count / total_patients * 100) if total_patients > 0 else 0,
+        'other_score_percent': (other_score_count / total_patients * 100) if total_patients > 0 else 0,
+        # Row masks for the Excel bucket sheets, so the export doesn't re-compare the scores
+        'high_mask': score_buckets == 2,
+        'mid_mask': score_buckets == 1
+    }
+
 # Generate Excel report with four sheets
-def generate_excel_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score):
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
+def generate_excel_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score, high_mask, mid_mask):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    # Write with xlsxwriter, without turning URL-like text into links
+    excel_options = {'strings_to_urls': False}
+    with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': excel_options}) as writer:
         report_df.to_excel(writer, sheet_name='Patient Report', index=False)
-        high_score_df = report_df[report_df['CompletionScore (%)'] >= 75]
+        # Bucket masks come precomputed from summarize_report
+        high_score_df = report_df[high_mask]
         high_score_df.to_excel(writer, sheet_name='Score >= 75%', index=False)
-        mid_score_df = report_df[(report_df['CompletionScore (%)'] >= 50) & (report_df['CompletionScore (%)'] < 75)]
+        mid_score_df = report_df[mid_mask]
         mid_score_df.to_excel(writer, sheet_name='Score 50-75%', index=False)
         dashboard_data = {
             'Category': ['Score >= 75%', 'Score < 50%', 'Score 50-75%'],
@@ -404,12 +509,118 @@ def generate_excel_report(report_df, total_patients, avg_score, max_score, min_s
     
     return output.getvalue()
 
+# Summary and detail table styles shared by every PDF build, created once on first use
+@lru_cache(maxsize=1)
+def pdf_table_styles():
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+    summary_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ])
+    detail_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+    return summary_style, detail_style
+
+# Detail table column widths in points, in report column order. They add up to 754pt, inside
+# the 757.9pt frame of a landscape A4 page with 36pt margins; each column is at least as wide
+# as the longest word of its 7pt bold header plus cell padding, and cells wrap inside them
+PDF_DETAIL_COL_WIDTHS = [56, 62, 72, 104, 76, 104, 50, 50, 60, 60, 60]
+
+# reportlab's sample stylesheet plus the detail-cell styles, built once and reused
+# (it is only read, never modified)
+@lru_cache(maxsize=1)
+def pdf_styles():
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle('DetailCell', parent=styles['BodyText'], fontSize=7, leading=8.5))
+    styles.add(ParagraphStyle('DetailHeader', parent=styles['DetailCell'], fontName='Helvetica-Bold', textColor=colors.whitesmoke))
+    return styles
+
+# Patient detail section of the PDF: heading, (capped) detail table and truncation note
+def build_pdf_detail_table(report_df, styles):
+    from reportlab.platypus import LongTable, Paragraph, Spacer
+    elements = []
+    elements.append(Paragraph("Patient Consultation Details", styles['Heading2']))
+    detail_df = report_df
+    if len(report_df) > PDF_DETAIL_ROW_LIMIT:
+        detail_df = report_df.nsmallest(PDF_DETAIL_ROW_LIMIT, 'CompletionScore (%)')
+    # Stringify and truncate whole columns at once instead of row by row
+    pdf_df = detail_df.astype(str).mask(detail_df.isna(), '')
+    for col in ('PatientId', 'ConsultationId', 'Status'):
+        pdf_df[col] = pdf_df[col].str.slice(0, 20)
+    for col in ('Symptoms', 'Diagnosis', 'Advice'):
+        too_long = pdf_df[col].str.len() > PDF_TEXT_CELL_LIMIT
+        pdf_df[col] = pdf_df[col].mask(too_long, pdf_df[col].str.slice(0, PDF_TEXT_CELL_LIMIT) + '...')
+    for col in pdf_df.columns:
+        # Paragraph text is markup, so escape it
+        pdf_df[col] = pdf_df[col].str.replace('&', '&amp;').str.replace('<', '&lt;').str.replace('>', '&gt;')
+    # Paragraph cells wrap within the fixed column widths
+    cell_style, header_style = styles['DetailCell'], styles['DetailHeader']
+    table_data = [[Paragraph(col, header_style) for col in report_df.columns]]
+    table_data += [[Paragraph(value, cell_style) for value in row] for row in pdf_df.values.tolist()]
+    
+    # LongTable splits across pages and repeats the header row on each one; splitInRow lets a row
+    # with very long text continue on the next page instead of failing the build
+    table = LongTable(table_data, colWidths=PDF_DETAIL_COL_WIDTHS, repeatRows=1, splitInRow=1)
+    table.setStyle(pdf_table_styles()[1])
+    elements.append(table)
+    if len(detail_df) < len(report_df):
+        elements.append(Spacer(1, 6))
+        elements.append(Paragraph(
+            f"Showing the {len(detail_df)} lowest-scoring of {len(report_df)} consultations; "
+            f"the remaining {len(report_df) - len(detail_df)} rows are in the Excel and CSV downloads.",
+            styles['Italic']
+        ))
+    return elements
+
+# Bar chart of CompletionScore (%), one bar per possible score, drawn with reportlab's own graphics
+def build_score_histogram(scores):
+    from reportlab.lib import colors
+    from reportlab.graphics.shapes import Drawing, String
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    # A score is filled fields / total fields, so count rows by filled fields (0..total)
+    total_fields = len(FIELDS_TO_CHECK)
+    filled = np.rint(scores.to_numpy(dtype=float) * total_fields / 100).astype(int)
+    counts = np.bincount(filled, minlength=total_fields + 1)
+    drawing = Drawing(450, 240)
+    chart = VerticalBarChart()
+    chart.x, chart.y, chart.width, chart.height = 40, 40, 390, 180
+    chart.data = [counts.tolist()]
+    chart.categoryAxis.categoryNames = [f"{round(n * 100 / total_fields, 2):g}" for n in range(total_fields + 1)]
+    chart.categoryAxis.labels.fontSize = 7
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontSize = 7
+    chart.bars[0].fillColor = colors.HexColor('#1e40af')
+    drawing.add(chart)
+    drawing.add(String(235, 8, "CompletionScore (%)", fontSize=8, textAnchor='middle'))
+    return drawing
+
 # Generate PDF report using reportlab
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
 def generate_pdf_report(report_df, total_patients, avg_score, max_score, min_score, avg_time, high_score_percent, low_score_percent, avg_missing_score):
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer, KeepTogether
     output = BytesIO()
-    doc = SimpleDocTemplate(output, pagesize=A4)
+    doc = SimpleDocTemplate(output, pagesize=landscape(A4), leftMargin=36, rightMargin=36)
     elements = []
-    styles = getSampleStyleSheet()
+    styles = pdf_styles()
 
     elements.append(Paragraph("eSanjeevani Teleconsultation Report", styles['Title']))
     elements.append(Spacer(1, 12))
@@ -426,57 +637,42 @@ def generate_pdf_report(report_df, total_patients, avg_score, max_score, min_sco
         ['Patients with Score < 50%', f"{low_score_percent:.2f}%"]
     ]
     summary_table = Table(summary_data)
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
+    summary_table.setStyle(pdf_table_styles()[0])
     elements.append(summary_table)
     elements.append(Spacer(1, 12))
-    elements.append(Paragraph("Patient Consultation Details", styles['Heading2']))
-    table_data = [list(report_df.columns)]
-    for _, row in report_df.iterrows():
-        row_data = [
-            str(row['PatientId'])[:20],
-            str(row['ConsultationId'])[:20],
-            str(row['CompletionScore (%)']),
-            str(row['CompletionField']),
-            str(row['MissingFieldScore']),
-            str(row['MissingFields']),
-            str(row['TimeTaken (MM:SS)']),
-            str(row['Status'])[:20],
-            str(row['Symptoms']),
-            str(row['Diagnosis']),
-            str(row['Advice'])
-        ]
-        table_data.append(row_data)
-    
-    table = Table(table_data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    elements.append(table)
+    if len(report_df) > PDF_CHART_ROW_THRESHOLD:
+        # Nobody reads thousands of table rows; summarise the spread so build time stays bounded
+        elements.append(KeepTogether([
+            Paragraph("Completion Score Distribution", styles['Heading2']),
+            build_score_histogram(report_df['CompletionScore (%)'])
+        ]))
+        elements.append(Spacer(1, 6))
+        elements.append(Paragraph(
+            f"The {len(report_df)} patient rows are not listed in the PDF; "
+            "use the Excel or CSV download for patient-level details.",
+            styles['Italic']
+        ))
+    else:
+        elements.extend(build_pdf_detail_table(report_df, styles))
     doc.build(elements)
     return output.getvalue()
 
+# Convert DataFrame to Parquet (zstd) for download
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
+def convert_df_to_parquet(df):
+    output = pa.BufferOutputStream()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), output, compression='zstd')
+    return output.getvalue().to_pybytes()
+
 # Convert DataFrame to CSV for download
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
 def convert_df_to_csv(df):
-    output = BytesIO()
-    df.to_csv(output, index=False)
-    return output.getvalue()
+    # Every report column has a single Arrow type: IDs and text are Arrow strings from load_excel
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Write with Arrow's C++ CSV writer straight into an Arrow buffer
+    output = pa.BufferOutputStream()
+    pacsv.write_csv(table, output)
+    return output.getvalue().to_pybytes()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file